@@ -1,32 +1,85 @@
 import argparse
 import asyncio
+import atexit
 import base64
 import logging
 import os
-from typing import Any, Iterable, Optional
+import queue
+import time
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, AsyncIterator, Optional
 
 import httpx
+import orjson
+from async_lru import alru_cache
+from cachetools import LRUCache
 from mcp.server.fastmcp import FastMCP
+from pydantic import ValidationError
 
-from src.models import MarketplaceItem
-from src.utils import get_app_version
+from src.models import ITEMS_ADAPTER, MarketplaceItem
+from src.utils import get_app_version, invalidate_cached_app_version
 
 LOG_FILE = os.path.join(
     os.path.dirname(os.path.abspath(__file__)), "..", "marketplace.log"
 )
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    filename=LOG_FILE,
-    filemode="w",
+# Records are queued from the event loop and written to disk by a listener
+# thread, so logging inside async code never blocks on file I/O.
+_log_file_handler = logging.FileHandler(LOG_FILE, mode="w")
+_log_file_handler.setFormatter(
+    logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 )
+_log_queue: queue.Queue[logging.LogRecord] = queue.Queue(-1)
+_log_listener = QueueListener(_log_queue, _log_file_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+# Attached directly rather than via basicConfig, which would give the queue
+# handler a second format and prefix every record twice.
+logging.root.setLevel(logging.INFO)
+logging.root.addHandler(QueueHandler(_log_queue))
 logger = logging.getLogger("marketplace-server")
 
-mcp = FastMCP("marketplace")
+# Shared HTTP client, created lazily and rebuilt when the event loop changes,
+# since its pooled connections belong to the loop that opened them
+_CLIENT: Optional[httpx.AsyncClient] = None
+_CLIENT_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+async def _get_client() -> httpx.AsyncClient:
+    global _CLIENT, _CLIENT_LOOP
+    loop = asyncio.get_running_loop()
+    if _CLIENT is None or _CLIENT.is_closed or _CLIENT_LOOP is not loop:
+        _CLIENT_LOOP = loop
+        _CLIENT = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+            timeout=httpx.Timeout(10.0),
+        )
+    return _CLIENT
+
+
+async def _close_client() -> None:
+    global _CLIENT, _CLIENT_LOOP
+    if _CLIENT is not None and _CLIENT_LOOP is asyncio.get_running_loop():
+        await _CLIENT.aclose()
+    _CLIENT = None
+    _CLIENT_LOOP = None
+
+
+@asynccontextmanager
+async def _lifespan(server: FastMCP) -> AsyncIterator[None]:
+    try:
+        yield
+    finally:
+        await _close_client()
+
+
+mcp = FastMCP("marketplace", lifespan=_lifespan)
 
 API_URL = base64.b64decode(
     "aHR0cHM6Ly9hcGkud2FsbGFwb3AuY29tL2FwaS92My9zZWFyY2g="
 ).decode()
+ITEM_BASE_URL = base64.b64decode("aHR0cHM6Ly9lcy53YWxsYXBvcC5jb20vaXRlbS8=").decode()
 USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:146.0) Gecko/20100101 Firefox/146.0"
 
 # Output mode (configurable via CLI: -d / --descriptions / --no-descriptions)
@@ -35,28 +88,78 @@ USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:146.0) Gecko/20100101 Firefox/1
 INCLUDE_DESCRIPTION_IN_SEARCH = True
 # How many pages to fetch per query in `search` (configurable via CLI: -p / --pages)
 SEARCH_PAGES_TO_FETCH = 5
+# Stop paginating a query once a page has fewer than this share of unseen ids
+MIN_NEW_ITEMS_RATIO = 0.2
 
 APP_VERSION: Optional[str] = None
 
-# Global caches
-ITEM_WEB_SLUG_CACHE: dict[str, str] = {}  # item id -> web_slug
-ITEM_DESCRIPTION_CACHE: dict[str, str] = {}  # item id -> description
+# Global caches, LRU-bounded so a long-running server doesn't grow unbounded
+# item id -> web_slug
+ITEM_WEB_SLUG_CACHE: LRUCache[str, str] = LRUCache(maxsize=20_000)
+# item id -> description
+ITEM_DESCRIPTION_CACHE: LRUCache[str, str] = LRUCache(maxsize=5_000)
 
 # Default coordinates
 DEFAULT_LAT = 43.3707332
 DEFAULT_LON = -8.3958532
 
+# Request throttling shared by all concurrent queries
+MAX_CONCURRENT_REQUESTS = 8
+MIN_REQUEST_INTERVAL = 0.05  # seconds between consecutive API requests
+
+
+class _RateLimiter:
+    """Enforce a minimum interval between consecutive requests."""
+
+    def __init__(self, min_interval: float) -> None:
+        self.min_interval = min_interval
+        self.last_ts = 0.0
+        self._lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        async with self._lock:
+            delay = self.min_interval - (time.monotonic() - self.last_ts)
+            await asyncio.sleep(max(0.0, delay))
+            self.last_ts = time.monotonic()
+
+
+# asyncio primitives bind to the loop that first waits on them, so they are
+# rebuilt whenever a different event loop starts issuing requests.
+_REQ_SEM: Optional[asyncio.Semaphore] = None
+_RATE_LIMITER: Optional[_RateLimiter] = None
+_THROTTLE_LOOP: Optional[asyncio.AbstractEventLoop] = None
+
+
+def _get_throttle() -> tuple[asyncio.Semaphore, _RateLimiter]:
+    global _REQ_SEM, _RATE_LIMITER, _THROTTLE_LOOP
+    loop = asyncio.get_running_loop()
+    if _REQ_SEM is None or _RATE_LIMITER is None or _THROTTLE_LOOP is not loop:
+        _REQ_SEM = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        _RATE_LIMITER = _RateLimiter(MIN_REQUEST_INTERVAL)
+        _THROTTLE_LOOP = loop
+    return _REQ_SEM, _RATE_LIMITER
+
+
+# Retry policy for transient API failures
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_BASE_DELAY = 0.5  # seconds, doubled on every attempt
+RETRY_MAX_DELAY = 8.0
+
+# Short-lived cache of rendered `search` results for repeated identical calls
+SEARCH_CACHE_SIZE = 128
+SEARCH_CACHE_TTL = 60  # seconds
+
 
 def format_item_markdown(item: MarketplaceItem) -> Optional[str]:
-    if item.reserved.flag is True:
+    if item.reserved_flag:
         return None
 
     title = " ".join(item.title.split())
-    price = f"{item.price.amount}€" if item.price.amount is not None else "N/A"
+    price = f"{item.price_amount}€" if item.price_amount is not None else "N/A"
     line = f"- `{item.id}` {title} - {price}"
 
     if INCLUDE_DESCRIPTION_IN_SEARCH and item.description:
-        line += f"\n  {' '.join(item.description.split())}"
+        return f"{line}\n  {' '.join(item.description.split())}"
 
     return line
 
@@ -77,10 +180,7 @@ async def link(item_ids: list[str]) -> str:
             )
             continue
 
-        item_base = base64.b64decode(
-            "aHR0cHM6Ly9lcy53YWxsYXBvcC5jb20vaXRlbS8="
-        ).decode()
-        lines.append(f"- `{item_id}`: {item_base}{slug}")
+        lines.append(f"- `{item_id}`: {ITEM_BASE_URL}{slug}")
 
     return "\n".join(lines)
 
@@ -135,7 +235,216 @@ async def search(query: list[str]) -> str:
     return await _search(query)
 
 
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    retry_after = response.headers.get("Retry-After")
+    if retry_after:
+        try:
+            return min(RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+        except ValueError:
+            pass  # HTTP-date form; fall back to exponential backoff
+    return min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt)
+
+
+async def _get_with_retry(
+    client: httpx.AsyncClient,
+    url: str,
+    *,
+    headers: dict[str, str],
+    params: dict[str, Any],
+    max_attempts: int = 3,
+) -> httpx.Response:
+    """GET `url`, retrying 429/5xx responses with exponential backoff."""
+
+    req_sem, rate_limiter = _get_throttle()
+    attempt = 0
+    while True:
+        async with req_sem:
+            await rate_limiter.wait()
+            response = await client.get(url, headers=headers, params=params)
+
+        try:
+            response.raise_for_status()
+            return response
+        except httpx.HTTPStatusError as exc:
+            status = exc.response.status_code
+            if status not in RETRYABLE_STATUS_CODES or attempt + 1 >= max_attempts:
+                raise
+
+            wait = _retry_delay(exc.response, attempt)
+            logger.warning(
+                "Retryable API error %s (attempt %s/%s), retrying in %.2fs",
+                status,
+                attempt + 1,
+                max_attempts,
+                wait,
+            )
+            await asyncio.sleep(wait)
+            attempt += 1
+
+
+def _is_listable(raw_item: Any) -> bool:
+    if not isinstance(raw_item, dict) or not raw_item.get("id"):
+        return False
+    reserved = raw_item.get("reserved")
+    return not (isinstance(reserved, dict) and reserved.get("flag") is True)
+
+
+def _validate_items(items: list[Any]) -> list[MarketplaceItem]:
+    try:
+        return ITEMS_ADAPTER.validate_python(items)
+    except ValidationError as exc:
+        # Drop only the items the errors point at and revalidate the rest
+        # in one batch; fall back to per-item validation if that fails too.
+        bad_indexes = {
+            err["loc"][0]
+            for err in exc.errors()
+            if err["loc"] and isinstance(err["loc"][0], int)
+        }
+        if bad_indexes:
+            logger.warning(
+                "Skipping %d invalid item payloads: %s", len(bad_indexes), exc
+            )
+            try:
+                return ITEMS_ADAPTER.validate_python(
+                    [raw for i, raw in enumerate(items) if i not in bad_indexes]
+                )
+            except ValidationError:
+                pass
+
+    validated: list[MarketplaceItem] = []
+    for raw_item in items:
+        try:
+            validated.append(MarketplaceItem.model_validate(raw_item))
+        except Exception as exc:
+            logger.warning("Skipping invalid item payload: %s", exc)
+    return validated
+
+
+async def _fetch_query(
+    client: httpx.AsyncClient,
+    current_query: str,
+    headers: dict[str, str],
+    pages: int,
+) -> list[MarketplaceItem]:
+    collected: list[MarketplaceItem] = []
+    api_next_page: Optional[str] = None
+    next_section_type: Optional[str] = "organic_search_results"
+    # Local aliases avoid a global lookup per item in the loop below
+    slug_cache = ITEM_WEB_SLUG_CACHE
+    description_cache = ITEM_DESCRIPTION_CACHE
+    seen_ids: set[str] = set()
+    pages_fetched = 0
+
+    logger.info("Starting query '%s'", current_query)
+
+    # Start from page 1 every time; continue via next_page token.
+    for page_number in range(1, pages + 1):
+        params: dict[str, Any] = {
+            "source": "recent_searches",
+            "keywords": current_query,
+            # "latitude": DEFAULT_LAT,
+            # "longitude": DEFAULT_LON,
+        }
+
+        if page_number > 1:
+            if not api_next_page:
+                break
+            params["next_page"] = api_next_page
+
+        logger.info(
+            "Requesting query '%s' page %s with app-version %s",
+            current_query,
+            page_number,
+            APP_VERSION,
+        )
+        response = await _get_with_retry(
+            client, API_URL, headers=headers, params=params
+        )
+        pages_fetched += 1
+        # Pages are small (~40 items) and are parsed in one go once buffered;
+        # other queries keep downloading concurrently while this one parses.
+        data = orjson.loads(response.content)
+
+        try:
+            items = data["data"]["section"]["payload"]["items"]
+        except (KeyError, TypeError):
+            items = []
+        logger.info(
+            "Found %d raw items for query '%s' page %s",
+            len(items),
+            current_query,
+            page_number,
+        )
+
+        page_ids = {
+            raw_item["id"]
+            for raw_item in items
+            if isinstance(raw_item, dict) and raw_item.get("id")
+        }
+        new_ids = page_ids - seen_ids
+        seen_ids |= new_ids
+
+        # Reserved and id-less items are never rendered, so skip validating them
+        listable = [raw_item for raw_item in items if _is_listable(raw_item)]
+
+        validated = _validate_items(listable)
+        for item in validated:
+            if item.web_slug:
+                slug_cache[item.id] = item.web_slug
+            if item.description:
+                description_cache[item.id] = item.description
+
+        collected.extend(validated)
+
+        meta = data.get("meta") or {}
+        api_next_page = meta.get("next_page")
+        next_section_type = meta.get("next_section_type")
+
+        logger.info(
+            "Query '%s' page %s meta: next_section_type=%s has_next_page=%s",
+            current_query,
+            page_number,
+            next_section_type,
+            bool(api_next_page),
+        )
+
+        if next_section_type != "organic_search_results":
+            logger.info(
+                "Stopping query '%s' early: next_section_type=%s",
+                current_query,
+                next_section_type,
+            )
+            break
+
+        # Later pages that mostly repeat earlier ones aren't worth another request
+        new_ratio = len(new_ids) / max(len(page_ids), 1)
+        if page_number >= 2 and new_ratio < MIN_NEW_ITEMS_RATIO:
+            logger.info(
+                "Stopping query '%s' early: only %d/%d new items on page %s",
+                current_query,
+                len(new_ids),
+                len(page_ids),
+                page_number,
+            )
+            break
+
+    logger.info(
+        "Finished query '%s': pages_fetched=%s items_collected=%s",
+        current_query,
+        pages_fetched,
+        len(collected),
+    )
+
+    return collected
+
+
+def _may_reject_app_version(status_code: int) -> bool:
+    return 400 <= status_code < 500 and status_code not in (404, 429)
+
+
 async def _search(query: list[str]) -> str:
+    global APP_VERSION
+
     pages = SEARCH_PAGES_TO_FETCH
     if pages < 1:
         return "Invalid SEARCH_PAGES_TO_FETCH: must be >= 1"
@@ -155,6 +464,33 @@ async def _search(query: list[str]) -> str:
         SEARCH_PAGES_TO_FETCH,
     )
 
+    try:
+        return await _search_cached(
+            tuple(queries), pages, INCLUDE_DESCRIPTION_IN_SEARCH
+        )
+    except httpx.HTTPStatusError as exc:
+        logger.error(
+            "API Error: %s - %s",
+            exc.response.status_code,
+            exc.response.text,
+        )
+        if _may_reject_app_version(exc.response.status_code):
+            # A stale x-appversion is one cause of client errors; re-detect
+            # it on the next search instead of reusing it until it expires.
+            APP_VERSION = None
+            invalidate_cached_app_version()
+        return f"API Error: {exc.response.status_code} - {exc.response.text}"
+    except Exception as exc:
+        logger.error("Unexpected error: %s", exc)
+        return f"An error occurred: {str(exc)}"
+
+
+# Errors propagate instead of being rendered, so failed searches are never cached.
+# `include_descriptions` is only part of the key: rendering depends on it.
+@alru_cache(maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL)
+async def _search_cached(
+    queries: tuple[str, ...], pages: int, include_descriptions: bool
+) -> str:
     global APP_VERSION
     if APP_VERSION is None:
         APP_VERSION = await get_app_version()
@@ -165,157 +501,49 @@ async def _search(query: list[str]) -> str:
         "x-deviceos": "0",
     }
 
-    async with httpx.AsyncClient() as client:
-        deduped_items: dict[str, MarketplaceItem] = {}
-
-        def _iter_items_in_order(
-            items_by_query: dict[str, list[MarketplaceItem]],
-        ) -> Iterable[MarketplaceItem]:
-            for q in queries:
-                for item in items_by_query.get(q, []):
-                    yield item
-
-        items_by_query: dict[str, list[MarketplaceItem]] = {q: [] for q in queries}
-        next_pages_by_query: dict[str, Optional[str]] = {q: None for q in queries}
-        next_section_type_by_query: dict[str, Optional[str]] = {
-            q: "organic_search_results" for q in queries
-        }
-
-        for current_query in queries:
-            api_next_page: Optional[str] = None
-            next_section_type: Optional[str] = "organic_search_results"
-
-            logger.info("Starting query '%s'", current_query)
-
-            # Start from page 1 every time; continue via next_page token.
-            for page_number in range(1, pages + 1):
-                params: dict[str, Any] = {
-                    "source": "recent_searches",
-                    "keywords": current_query,
-                    # "latitude": DEFAULT_LAT,
-                    # "longitude": DEFAULT_LON,
-                }
-
-                if page_number > 1:
-                    if not api_next_page:
-                        break
-                    params["next_page"] = api_next_page
-
-                try:
-                    logger.info(
-                        "Requesting query '%s' page %s with app-version %s",
-                        current_query,
-                        page_number,
-                        APP_VERSION,
-                    )
-                    response = await client.get(API_URL, headers=headers, params=params)
-                    response.raise_for_status()
-                    data = response.json()
-
-                    items = (
-                        data.get("data", {})
-                        .get("section", {})
-                        .get("payload", {})
-                        .get("items", [])
-                    )
-                    logger.info(
-                        "Found %d raw items for query '%s' page %s",
-                        len(items),
-                        current_query,
-                        page_number,
-                    )
-
-                    for raw_item in items:
-                        try:
-                            item = MarketplaceItem.model_validate(raw_item)
-                        except Exception as exc:
-                            logger.warning("Skipping invalid item payload: %s", exc)
-                            continue
-
-                        if item.id:
-                            if item.web_slug:
-                                ITEM_WEB_SLUG_CACHE[item.id] = item.web_slug
-                            if item.description:
-                                ITEM_DESCRIPTION_CACHE[item.id] = item.description
-
-                        items_by_query[current_query].append(item)
-                        if item.id:
-                            deduped_items.setdefault(item.id, item)
-
-                    api_next_page = data.get("meta", {}).get("next_page")
-                    next_section_type = data.get("meta", {}).get("next_section_type")
-
-                    logger.info(
-                        "Query '%s' page %s meta: next_section_type=%s has_next_page=%s",
-                        current_query,
-                        page_number,
-                        next_section_type,
-                        bool(api_next_page),
-                    )
-
-                    if next_section_type != "organic_search_results":
-                        logger.info(
-                            "Stopping query '%s' early: next_section_type=%s",
-                            current_query,
-                            next_section_type,
-                        )
-                        break
-
-                except httpx.HTTPStatusError as exc:
-                    logger.error(
-                        "API Error: %s - %s",
-                        exc.response.status_code,
-                        exc.response.text,
-                    )
-                    return (
-                        f"API Error: {exc.response.status_code} - {exc.response.text}"
-                    )
-                except Exception as exc:
-                    logger.error("Unexpected error: %s", exc)
-                    return f"An error occurred: {str(exc)}"
-
-            next_pages_by_query[current_query] = api_next_page
-            next_section_type_by_query[current_query] = next_section_type
-
-            logger.info(
-                "Finished query '%s': pages_requested=%s items_collected=%s unique_so_far=%s",
-                current_query,
-                SEARCH_PAGES_TO_FETCH,
-                len(items_by_query[current_query]),
-                len(deduped_items),
-            )
+    client = await _get_client()
+    # Queries run concurrently; pages within a query stay sequential
+    # because each page needs the next_page token from the previous one.
+    tasks = [
+        asyncio.create_task(_fetch_query(client, q, headers, pages)) for q in queries
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        # The first failure aborts the search; don't keep paging the others
+        for task in tasks:
+            task.cancel()
+        raise
+
+    # Results are merged in query order, so the first occurrence of an id wins
+    unique_items: dict[str, MarketplaceItem] = {}
+    total_raw = 0
+    for result in results:
+        total_raw += len(result)
+        for item in result:
+            if item.id:
+                unique_items.setdefault(item.id, item)
 
     logger.info(
         "Deduplicating merged results: queries=%s total_raw=%s unique_ids=%s",
         len(queries),
-        sum(len(v) for v in items_by_query.values()),
-        len(deduped_items),
+        total_raw,
+        len(unique_items),
     )
 
-    ordered_unique_items: list[MarketplaceItem] = []
-    seen_ids: set[str] = set()
-    for item in _iter_items_in_order(items_by_query):
-        if not item.id:
-            continue
-        if item.id in seen_ids:
-            continue
-        seen_ids.add(item.id)
-        ordered_unique_items.append(deduped_items[item.id])
-
-    blocks: list[str] = []
-    for item in ordered_unique_items:
-        block = format_item_markdown(item)
-        if block is None:
-            continue
-        blocks.append(block)
+    blocks = [
+        block
+        for block in map(format_item_markdown, unique_items.values())
+        if block is not None
+    ]
 
     if not blocks:
         readable_queries = ", ".join(f"'{q}'" for q in queries)
         return f"No results found for {readable_queries}."
 
     logger.info(
-        "Rendering response: items_returned=%s (reserved filtered later)",
-        len(ordered_unique_items),
+        "Rendering response: items_returned=%s",
+        len(unique_items),
     )
 
     footer_parts: list[str] = []
@@ -1,20 +1,24 @@
 from typing import Optional
 
-from pydantic import BaseModel, Field
-
-
-class Reserved(BaseModel):
-    flag: bool = False
-
-
-class Price(BaseModel):
-    amount: Optional[float] = None
+from pydantic import AliasPath, BaseModel, ConfigDict, Field, TypeAdapter
 
 
 class MarketplaceItem(BaseModel):
+    model_config = ConfigDict(extra="ignore", frozen=True)
+
     title: str = "No title"
     id: str = ""
     web_slug: str = ""
     description: str = ""
-    reserved: Reserved = Field(default_factory=Reserved)
-    price: Price = Field(default_factory=Price)
+    # Read straight from the nested `reserved.flag` / `price.amount` payload
+    # fields instead of validating two single-field submodels per item.
+    reserved_flag: bool = Field(
+        default=False, validation_alias=AliasPath("reserved", "flag")
+    )
+    price_amount: Optional[float] = Field(
+        default=None, validation_alias=AliasPath("price", "amount")
+    )
+
+
+# Validates a whole page of items in a single pydantic-core call
+ITEMS_ADAPTER = TypeAdapter(list[MarketplaceItem])
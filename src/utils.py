@@ -1,6 +1,10 @@
 import base64
+import json
 import logging
+import os
 import re
+import time
+from typing import Optional
 
 import httpx
 
@@ -8,12 +12,67 @@ import httpx
 BASE_URL = base64.b64decode("aHR0cHM6Ly9lcy53YWxsYXBvcC5jb20v").decode()
 USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64; rv:146.0) Gecko/20100101 Firefox/146.0"
 
+# On-disk app version cache, so warm restarts skip the homepage fetch. It lives
+# in the per-user cache dir so other local users can't plant a header value.
+APP_VERSION_CACHE_PATH = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "marketplace-server",
+    "app_version.json",
+)
+APP_VERSION_CACHE_TTL = 86400  # seconds
+
+# Matched against the raw HTML bytes to avoid decoding the whole page
+_APPVER_RE = re.compile(rb'data-app-version="([^"]+)"')
+
 logger = logging.getLogger("marketplace-server")
 
 
+def _read_cached_app_version() -> Optional[str]:
+    try:
+        age = time.time() - os.path.getmtime(APP_VERSION_CACHE_PATH)
+        if age >= APP_VERSION_CACHE_TTL:
+            return None
+        with open(APP_VERSION_CACHE_PATH, encoding="utf-8") as f:
+            version = json.load(f)["v"]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+    return version if isinstance(version, str) and version else None
+
+
+def _write_cached_app_version(version: str) -> None:
+    tmp_path = f"{APP_VERSION_CACHE_PATH}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(APP_VERSION_CACHE_PATH), mode=0o700, exist_ok=True)
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"v": version}, f)
+        os.replace(tmp_path, APP_VERSION_CACHE_PATH)
+    except OSError as exc:
+        logger.warning("Failed to cache app version: %s", exc)
+
+
+def invalidate_cached_app_version() -> None:
+    """Remove the on-disk app version so the next lookup re-detects it."""
+
+    try:
+        os.remove(APP_VERSION_CACHE_PATH)
+        logger.info("Removed cached app version at %s", APP_VERSION_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        logger.warning("Failed to remove cached app version: %s", exc)
+
+
 async def get_app_version() -> str:
     """Fetch the current app version from marketplace website using regex."""
 
+    cached = _read_cached_app_version()
+    if cached:
+        logger.info(
+            "Using cached app version: %s (from %s)", cached, APP_VERSION_CACHE_PATH
+        )
+        return cached
+
     logger.info("Fetching app version from %s", BASE_URL)
     headers = {"User-Agent": USER_AGENT}
 
@@ -22,15 +81,16 @@ async def get_app_version() -> str:
             response = await client.get(BASE_URL, headers=headers)
             response.raise_for_status()
 
-            match = re.search(r'data-app-version="([^"]+)"', response.text)
+            match = _APPVER_RE.search(response.content)
             if match:
-                version = match.group(1)
+                version = match.group(1).decode("ascii", errors="replace")
                 formatted_version = version.replace(".", "")
                 logger.info(
                     "Detected app version: %s (formatted: %s)",
                     version,
                     formatted_version,
                 )
+                _write_cached_app_version(formatted_version)
                 return formatted_version
 
             logger.warning("App version not found in HTML, using fallback")
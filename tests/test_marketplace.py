@@ -0,0 +1,154 @@
+import asyncio
+from pathlib import Path
+from typing import Callable
+
+import httpx
+import pytest
+
+from src import marketplace, utils
+from src.models import MarketplaceItem
+
+Handler = Callable[[httpx.Request], httpx.Response]
+
+
+def _get(handler: Handler) -> httpx.Response:
+    async def run() -> httpx.Response:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await marketplace._get_with_retry(
+                client, marketplace.API_URL, headers={}, params={}
+            )
+
+    return asyncio.run(run())
+
+
+@pytest.fixture(autouse=True)
+def no_retry_delay(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(marketplace, "RETRY_BASE_DELAY", 0.0)
+
+
+def test_get_with_retry_retries_transient_status() -> None:
+    statuses = [503, 429, 200]
+    calls: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(statuses[len(calls) - 1])
+
+    response = _get(handler)
+
+    assert response.status_code == 200
+    assert len(calls) == 3
+
+
+def test_get_with_retry_raises_after_max_attempts() -> None:
+    calls: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(503, headers={"Retry-After": "0"})
+
+    with pytest.raises(httpx.HTTPStatusError):
+        _get(handler)
+
+    assert len(calls) == 3
+
+
+def test_get_with_retry_does_not_retry_client_errors() -> None:
+    calls: list[httpx.Request] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request)
+        return httpx.Response(404)
+
+    with pytest.raises(httpx.HTTPStatusError):
+        _get(handler)
+
+    assert len(calls) == 1
+
+
+def _search_page(items: list[dict], next_page: str = "next") -> dict:
+    return {
+        "data": {"section": {"payload": {"items": items}}},
+        "meta": {
+            "next_page": next_page,
+            "next_section_type": "organic_search_results",
+        },
+    }
+
+
+def _fetch(handler: Handler, pages: int) -> list[MarketplaceItem]:
+    async def run() -> list[MarketplaceItem]:
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await marketplace._fetch_query(client, "query", {}, pages)
+
+    return asyncio.run(run())
+
+
+def test_validate_items_skips_only_invalid_payloads() -> None:
+    items = [
+        {"id": "a", "title": "valid"},
+        {"id": "b", "title": None},
+        {"id": "c", "price": {"amount": "not a number"}},
+        {"id": "d", "price": {"amount": 12.5}},
+    ]
+
+    validated = marketplace._validate_items(items)
+
+    assert [item.id for item in validated] == ["a", "d"]
+    assert validated[1].price_amount == 12.5
+
+
+def test_fetch_query_drops_invalid_reserved_and_idless_items() -> None:
+    items = [
+        {"id": "valid", "title": "Bike", "web_slug": "bike-1"},
+        {"id": "invalid", "title": None},
+        {"id": "reserved", "title": "Sofa", "reserved": {"flag": True}},
+        {"title": "No id"},
+        {"id": "free", "title": "Lamp", "reserved": {"flag": False}},
+    ]
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, json=_search_page(items))
+
+    collected = _fetch(handler, pages=1)
+
+    assert [item.id for item in collected] == ["valid", "free"]
+    assert marketplace.ITEM_WEB_SLUG_CACHE["valid"] == "bike-1"
+
+
+def test_client_error_invalidates_cached_app_version(
+    monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    cache_path = tmp_path / "app_version.json"
+    cache_path.write_text('{"v": "stale"}')
+    monkeypatch.setattr(utils, "APP_VERSION_CACHE_PATH", str(cache_path))
+    monkeypatch.setattr(marketplace, "APP_VERSION", "stale")
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.headers["x-appversion"] == "stale"
+        return httpx.Response(403, text="forbidden")
+
+    async def get_client() -> httpx.AsyncClient:
+        return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    monkeypatch.setattr(marketplace, "_get_client", get_client)
+
+    result = asyncio.run(marketplace._search(["bike"]))
+
+    assert result == "API Error: 403 - forbidden"
+    assert marketplace.APP_VERSION is None
+    assert not cache_path.exists()
+
+
+def test_fetch_query_stops_when_page_repeats_seen_ids() -> None:
+    requested_pages: list[str | None] = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested_pages.append(request.url.params.get("next_page"))
+        items = [{"id": f"item-{i}", "title": "Same"} for i in range(10)]
+        return httpx.Response(200, json=_search_page(items))
+
+    collected = _fetch(handler, pages=5)
+
+    assert requested_pages == [None, "next"]
+    assert len({item.id for item in collected}) == 10